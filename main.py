@@ -1,61 +1,193 @@
+import asyncio
+import base64
+import functools
+import gzip
+import io
+import itertools
+import json
 import os
+import re
 import smtplib
 import ssl
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from html import escape
+from urllib.parse import urlsplit
 
+import aiohttp
 import feedparser
 import yaml
 import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+try:  # loader C de libyaml si PyYAML a été compilé avec
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 
 # ---------- Utils ----------
+@functools.lru_cache(maxsize=4096)
 def strip_html(html: str) -> str:
     if not html:
         return ""
-    soup = BeautifulSoup(html, "html5lib")
+    soup = BeautifulSoup(html, "lxml")
     return soup.get_text(" ", strip=True)
 
+_SENT_RE = re.compile(r"[^.!?]*[.!?]")
+
 def first_sentences(text: str, max_sentences: int = 2) -> str:
     if not text:
         return ""
-    parts, start = [], 0
-    for i, ch in enumerate(text):
-        if ch in ".!?":
-            parts.append(text[start:i+1].strip())
-            start = i + 1
-            if len(parts) >= max_sentences:
-                break
+    matches = itertools.islice(_SENT_RE.finditer(text), max_sentences)
+    parts = [m.group().strip() for m in matches]
     if not parts:
         parts = [text[:240].strip()]
     return " ".join(parts)
 
+# Session HTTP partagée : la connexion TLS vers l'API Telegram est réutilisée
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
 def load_yaml(path: str):
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
 
 def load_template(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
-def fetch_items(rss_url: str):
-    feed = feedparser.parse(rss_url)
+def load_feed_cache(path: str) -> dict:
+    """Charge {url: {"etag", "modified", "headers", "body"}} ; vide si absent ou illisible."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_feed_cache(path: str, cache: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+
+# Seuls en-têtes dont parse_feed a besoin pour re-parser un corps en cache
+CACHED_HEADERS = ("content-type", "content-location")
+
+def feed_cache_entry(content: bytes, headers: dict) -> dict:
+    """Validateurs HTTP + dernier corps reçu, pour pouvoir le re-parser sur un 304."""
+    return {
+        "etag": headers.get("etag"),
+        "modified": headers.get("last-modified"),
+        "headers": {k: headers[k] for k in CACHED_HEADERS if k in headers},
+        "body": base64.b64encode(content).decode("ascii"),
+    }
+
+FEED_TIMEOUT = aiohttp.ClientTimeout(total=20)
+
+async def fetch_one(session: aiohttp.ClientSession, rss_url: str, cache: dict,
+                    slots: asyncio.Semaphore):
+    # GET conditionnel : le serveur répond 304 sans corps si le flux n'a pas bougé.
+    # On ne le tente que si le corps précédent est en cache pour le réutiliser.
+    prev = cache.get(rss_url) or {}
+    req_headers = {}
+    if prev.get("body"):
+        if prev.get("etag"):
+            req_headers["If-None-Match"] = prev["etag"]
+        if prev.get("modified"):
+            req_headers["If-Modified-Since"] = prev["modified"]
+
+    # Le délai de 20 s ne démarre qu'une fois un créneau obtenu, pas pendant l'attente
+    async with slots, session.get(rss_url, headers=req_headers, timeout=FEED_TIMEOUT) as resp:
+        if resp.status == 304 and prev.get("body"):
+            return base64.b64decode(prev["body"]), prev["headers"]
+        resp.raise_for_status()
+        content = await resp.read()
+        # feedparser a besoin du Content-Type pour deviner l'encodage...
+        headers = {k.lower(): v for k, v in resp.headers.items()}
+    # ...et de l'URL du document pour résoudre les liens relatifs des entrées
+    headers.setdefault("content-location", str(resp.url))
+    return content, headers
+
+def parse_feed(content: bytes, headers: dict):
+    """Parse un flux déjà téléchargé (exécuté dans un process séparé)."""
+    # BytesIO : sinon feedparser essaie d'abord open(content), un corps qui
+    # ressemble à un chemin local serait lu depuis le disque
+    feed = feedparser.parse(io.BytesIO(content), response_headers=headers)
     return feed.entries if hasattr(feed, "entries") else []
 
-def within_lookback(published_parsed, lookback_hours: int) -> bool:
+# En-têtes que feedparser envoyait lui-même quand il téléchargeait les flux
+FEED_HEADERS = {
+    "User-Agent": feedparser.USER_AGENT,
+    "Accept": "application/atom+xml,application/rdf+xml,application/rss+xml,"
+              "application/xml;q=0.9,text/xml;q=0.2,*/*;q=0.1",
+    "Accept-Encoding": "gzip, deflate",
+}
+
+async def fetch_all(urls: list, max_connections: int = 10, cache: dict = None):
+    """Télécharge tous les flux en parallèle.
+
+    Renvoie, dans l'ordre des URLs, (contenu, en-têtes) ou l'exception levée.
+    Un flux inchangé (304) renvoie le corps mis en cache ; cache n'est pas modifié.
+    """
+    cache = {} if cache is None else cache
+    slots = asyncio.Semaphore(max_connections)
+    async with aiohttp.ClientSession(headers=FEED_HEADERS) as session:
+        return await asyncio.gather(
+            *[fetch_one(session, url, cache, slots) for url in urls],
+            return_exceptions=True,
+        )
+
+def lookback_cutoff(lookback_hours: int) -> tuple:
+    """Limite basse (UTC) sous forme de tuple comparable à published_parsed[:6]."""
+    return (datetime.now(timezone.utc) - timedelta(hours=lookback_hours)).timetuple()[:6]
+
+def within_lookback(published_parsed, cutoff: tuple) -> bool:
     if not published_parsed:
         return True
-    published_dt = datetime(*published_parsed[:6])
-    return published_dt >= datetime.utcnow() - timedelta(hours=lookback_hours)
+    return tuple(published_parsed[:6]) >= cutoff
+
+TELEGRAM_MAX_CHARS = 4000  # l'API refuse les messages > 4096 caractères
+TELEGRAM_MAX_TITLE = 300
 
-def telegram_send(token: str, chat_id: str, text: str):
+def shorten(text: str, max_chars: int = TELEGRAM_MAX_TITLE) -> str:
+    """Tronque un texte (avant échappement) pour qu'une ligne reste bien sous la limite."""
+    return text if len(text) <= max_chars else text[:max_chars - 1].rstrip() + "…"
+
+def chunk_lines(lines: list, max_chars: int = TELEGRAM_MAX_CHARS, sep: str = "\n\n") -> list:
+    """Regroupe les lignes en messages de max_chars caractères au plus.
+
+    Une ligne n'est coupée que si elle dépasse à elle seule max_chars.
+    """
+    # Découpe d'abord les lignes trop longues pour tenir dans un message
+    lines = [
+        line[i:i + max_chars]
+        for line in lines
+        for i in range(0, len(line) or 1, max_chars)
+    ]
+    chunks, current, size = [], [], 0
+    for line in lines:
+        extra = len(line) + (len(sep) if current else 0)
+        if current and size + extra > max_chars:
+            chunks.append(sep.join(current))
+            current, size = [], 0
+            extra = len(line)
+        current.append(line)
+        size += extra
+    if current:
+        chunks.append(sep.join(current))
+    return chunks
+
+def telegram_send(token: str, chat_id: str, text: str, parse_mode: str = None):
     """Envoie un message Telegram et lève une erreur si l'API refuse."""
-    r = requests.post(
+    payload = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    r = SESSION.post(
         f"https://api.telegram.org/bot{token}/sendMessage",
-        json={"chat_id": chat_id, "text": text, "disable_web_page_preview": True},
+        json=payload,
         timeout=20,
     )
     # Vérifie proprement la réponse
@@ -67,15 +199,8 @@ def telegram_send(token: str, chat_id: str, text: str):
         # Exemple: {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'}
         raise RuntimeError(f"Telegram API error: {data}")
 
-def build_html(items: list, template: str, title: str, lookback: int) -> str:
-    def item_html(it):
-        link = it.get("link", "#")
-        title = strip_html(it.get("title", "(sans titre)"))
-        desc = strip_html(it.get("summary", ""))
-        desc = first_sentences(desc, 2)
-        source = strip_html(it.get("source", {}).get("title", it.get("author", "")))
-        source = source or (it.get("feedburner_origlink") and "FeedBurner") or ""
-        return f"""
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+_ITEM_TMPL = """
         <div class="item">
           <a class="title" href="{link}">{title}</a>
           <p>{desc}</p>
@@ -83,16 +208,51 @@ def build_html(items: list, template: str, title: str, lookback: int) -> str:
         </div>
         """
 
-    items_html = "\n".join(item_html(i) for i in items)
+def safe_link(link: str) -> str:
+    """Lien http(s) tel quel, "#" pour tout autre schéma (javascript:, data:, ...)."""
+    if link and urlsplit(link.strip()).scheme.lower() in ("http", "https"):
+        return link.strip()
+    return "#"
+
+def prepare_item(it):
+    """Titre nettoyé et versions échappées, calculés une seule fois par entrée."""
+    if "_clean_title" not in it:
+        it["_clean_title"] = strip_html(it.get("title", "(sans titre)"))
+        it["_html_title"] = escape(it["_clean_title"])
+        it["_html_link"] = escape(safe_link(it.get("link")), quote=True)
+    return it
+
+def build_html(items: list, template: str, title: str, lookback: int) -> str:
+    parts = [None] * len(items)
+    for idx, it in enumerate(items):
+        prepare_item(it)
+        desc = first_sentences(strip_html(it.get("summary", "")), 2)
+        source_info = it.get("source") or {}
+        source = strip_html(source_info.get("title", it.get("author", "")))
+        source = source or (it.get("feedburner_origlink") and "FeedBurner") or ""
+        parts[idx] = _ITEM_TMPL.format_map({
+            "link": it["_html_link"],
+            "title": it["_html_title"],
+            "desc": escape(desc),
+            "source": escape(source),
+        })
+
+    items_html = "".join(parts)
     now = datetime.now().strftime("%Y-%m-%d %H:%M")
-    return (
-        template
-        .replace("{{TITLE}}", title)
-        .replace("{{DATE}}", now)
-        .replace("{{LOOKBACK}}", str(lookback))
-        .replace("{{COUNT}}", str(len(items)))
-        .replace("{{ITEMS}}", items_html)
-    )
+    mapping = {
+        "TITLE": escape(title),
+        "DATE": now,
+        "LOOKBACK": str(lookback),
+        "COUNT": str(len(items)),
+        "ITEMS": items_html,
+    }
+    # Un seul passage sur le template ; les placeholders inconnus restent tels quels
+    return _PLACEHOLDER_RE.sub(lambda m: mapping.get(m.group(1), m.group(0)), template)
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context() -> ssl.SSLContext:
+    # Construit (et charge le bundle CA) au premier envoi seulement, puis réutilisé
+    return ssl.create_default_context()
 
 def send_email(smtp_host: str, smtp_port: int, smtp_user: str, smtp_pass: str, from_addr: str, to_addr: str, subject: str, html_body: str):
     msg = MIMEMultipart("alternative")
@@ -101,11 +261,10 @@ def send_email(smtp_host: str, smtp_port: int, smtp_user: str, smtp_pass: str, f
     msg["To"] = to_addr
     msg.attach(MIMEText(html_body, "html", "utf-8"))
 
-    context = ssl.create_default_context()
     with smtplib.SMTP(smtp_host, smtp_port) as server:
-        server.starttls(context=context)
+        server.starttls(context=_ssl_context())
         server.login(smtp_user, smtp_pass)
-        server.sendmail(from_addr, [to_addr], msg.as_string())
+        server.sendmail(from_addr, [to_addr], msg.as_bytes())
 
 
 # ---------- Main ----------
@@ -132,15 +291,37 @@ if __name__ == "__main__":
     config = load_yaml("feeds.yaml")
     template = load_template("templates/email_template.html")
 
-    # Collecte des articles
+    # Collecte des articles (flux récupérés en parallèle)
+    urls = config.get("feeds", [])
+    FETCH_WORKERS = int(os.getenv("FETCH_WORKERS") or 0) or min(10, len(urls)) or 1
+    feed_cache = load_feed_cache("feeds_cache.json")
+    downloads = asyncio.run(fetch_all(urls, FETCH_WORKERS, feed_cache))
+    cutoff = lookback_cutoff(LOOKBACK)
+
+    # Le parsing XML est CPU-bound : on le répartit sur plusieurs process
+    PARSE_WORKERS = int(os.getenv("PARSE_WORKERS") or 0) or None
     items = []
-    for url in config.get("feeds", []):
-        try:
-            for entry in fetch_items(url):
-                if within_lookback(entry.get("published_parsed"), LOOKBACK):
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        jobs = []
+        for url, result in zip(urls, downloads):
+            if isinstance(result, Exception):
+                # str() de asyncio.TimeoutError est vide : on affiche aussi le type
+                print(f"[WARN] {url}: {type(result).__name__}: {result}")
+            else:
+                jobs.append((url, result, pool.submit(parse_feed, *result)))
+        # On garde l'ordre de feeds.yaml pour que la déduplication reste stable
+        for url, result, job in jobs:
+            try:
+                entries = job.result()
+            except Exception as e:
+                print(f"[WARN] {url}: {type(e).__name__}: {e}")
+                continue
+            # Le cache n'est mis à jour que pour un flux parsé avec succès
+            feed_cache[url] = feed_cache_entry(*result)
+            for entry in entries:
+                if within_lookback(entry.get("published_parsed"), cutoff):
                     items.append(entry)
-        except Exception as e:
-            print(f"[WARN] {url}: {e}")
+    save_feed_cache("feeds_cache.json", feed_cache)
 
     # Déduplication simple
     seen = set()
@@ -158,7 +339,10 @@ if __name__ == "__main__":
     html = build_html(uniq, template, TITLE, LOOKBACK)
     with open("newsletter.html", "w", encoding="utf-8") as f:
         f.write(html)
-    print("[OK] Newsletter générée -> newsletter.html")
+    # Copie compressée, servable telle quelle (Content-Encoding: gzip)
+    with gzip.open("newsletter.html.gz", "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(html)
+    print("[OK] Newsletter générée -> newsletter.html (+ .gz)")
 
     # Email (désactivé dans ton workflow par défaut)
     if EMAIL_ENABLED and SMTP_HOST and SMTP_USER and SMTP_PASS and EMAIL_TO:
@@ -174,17 +358,23 @@ if __name__ == "__main__":
     # Telegram (avec vérif d'erreurs)
     if TELEGRAM_ENABLED and TG_TOKEN and TG_CHAT:
         try:
-            lines = [f"{TITLE} — {len(uniq)} actus"]
-            for it in uniq:
-                t = strip_html(it.get("title", "(sans titre)"))
-                link = it.get("link", "")
-                lines.append(f"• {t}\n{link}")
+            # parse_mode HTML : titres cliquables. Les textes sont tronqués avant
+            # échappement, couper du HTML déjà construit casserait le parsing
+            lines = [f"<b>{escape(shorten(TITLE))}</b> — {len(uniq)} actus"]
+            for it in map(prepare_item, uniq):
+                t = escape(shorten(it["_clean_title"]))
+                line = f'• <a href="{it["_html_link"]}">{t}</a>'
+                if it["_html_link"] == "#" or len(line) > TELEGRAM_MAX_CHARS:
+                    line = f"• {t}"
+                lines.append(line)
 
             masked = TG_TOKEN[:7] + "..." + TG_TOKEN[-4:] if len(TG_TOKEN) > 12 else "****"
             print(f"[DEBUG] Envoi Telegram → chat_id={TG_CHAT}, token={masked}")
 
-            telegram_send(TG_TOKEN, TG_CHAT, "\n\n".join(lines))
-            print("[OK] Telegram envoyé.")
+            chunks = chunk_lines(lines)
+            for chunk in chunks:
+                telegram_send(TG_TOKEN, TG_CHAT, chunk, parse_mode="HTML")
+            print(f"[OK] Telegram envoyé ({len(chunks)} message(s)).")
         except Exception as e:
             print(f"[ERR] Telegram: {e}")
     else: